@@ -13,19 +13,25 @@ Fields expected: {"broker":"...", "port":1883, "username":"...", "password":"...
 TLS is optional; if tls=true and cafile provided, it will load it.
 """
 
-import json
 import sys
-import time
 from pathlib import Path
+from types import MappingProxyType
 
+# Shared MQTT helpers live in the repo's scripts/ directory (this file is config/systemd/)
+SCRIPTS_DIR = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
 try:
-    import paho.mqtt.client as mqtt
+    import mqtt_common
 except ImportError:
-    print("Error: paho-mqtt not installed. Run: pip3 install paho-mqtt", file=sys.stderr)
+    print(f"Error: mqtt_common.py not found in {SCRIPTS_DIR}", file=sys.stderr)
     sys.exit(1)
 
+mqtt_common.require_paho_v2()
+import paho.mqtt.client as mqtt
+
+
 # ---------- Adjust if you want multiple dashboards ----------
-DEVICE_IDENTIFIERS = ["raspi-dashboard-1"]  # must match across entities to group as one device
+DEVICE_IDENTIFIERS = ("raspi-dashboard-1",)  # must match across entities to group as one device
 DISCOVERY_PREFIX = "homeassistant"          # default HA discovery prefix
 NODE_NAME = "Raspberry Pi Dashboard"        # device name in HA
 MODEL = "Pi + HDMI Display"
@@ -38,6 +44,46 @@ TOPIC_COMMAND = "dashboard/display/command"
 TOPIC_STATUS = "dashboard/display/status"
 TOPIC_AVAIL = "dashboard/display/availability"
 
+# Discovery payloads are constant, so build them read-only and serialize once at import
+DEVICE_BLOCK = MappingProxyType({
+    "identifiers": DEVICE_IDENTIFIERS,
+    "name": NODE_NAME,
+    "manufacturer": MANUFACTURER,
+    "model": MODEL,
+})
+
+SWITCH_PAYLOAD = MappingProxyType({
+    "name": "Dashboard Display",
+    "unique_id": UNIQUE_SWITCH,
+    "command_topic": TOPIC_COMMAND,
+    "state_topic": TOPIC_STATUS,
+    "availability_topic": TOPIC_AVAIL,
+    "payload_on": "on",
+    "payload_off": "off",
+    "state_on": "on",
+    "state_off": "off",
+    # Map 'unknown' -> unknown so HA shows it correctly
+    "value_template": "{% if value == 'on' %}on{% elif value == 'off' %}off{% else %}unknown{% endif %}",
+    "device": DEVICE_BLOCK,
+})
+
+BUTTON_PAYLOAD = MappingProxyType({
+    "name": "Dashboard Display: Refresh Status",
+    "unique_id": UNIQUE_BUTTON,
+    "command_topic": TOPIC_COMMAND,
+    "payload_press": "status",
+    "availability_topic": TOPIC_AVAIL,
+    "device": DEVICE_BLOCK,
+})
+
+# default=dict lets the JSON encoder serialize the read-only mappings
+SWITCH_PAYLOAD_JSON = mqtt_common.dumps(SWITCH_PAYLOAD, default=dict)
+BUTTON_PAYLOAD_JSON = mqtt_common.dumps(BUTTON_PAYLOAD, default=dict)
+
+# Discovery topics (retain=True so HA picks them up anytime)
+TOPIC_SWITCH_CFG = f"{DISCOVERY_PREFIX}/switch/dashboard_display/config"
+TOPIC_BUTTON_CFG = f"{DISCOVERY_PREFIX}/button/dashboard_display_status/config"
+
 # Config path (same as your listener)
 CONFIG_FILE = Path.home() / "dashboard-project" / "config" / "mqtt.json"
 
@@ -46,60 +92,28 @@ def load_cfg(path: Path) -> dict:
     if not path.exists():
         print(f"Config file not found: {path}", file=sys.stderr)
         sys.exit(1)
-    with open(path, "r") as f:
-        cfg = json.load(f)
+    with open(path, "rb") as f:
+        cfg = mqtt_common.loads(f.read())
     if "broker" not in cfg or "port" not in cfg:
         print("Config must contain at least: broker, port", file=sys.stderr)
         sys.exit(1)
     return cfg
 
 
-def on_connect(client, userdata, flags, rc):
-    if rc != 0:
-        print(f"Failed to connect, rc={rc}", file=sys.stderr)
+def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code.is_failure:
+        print(f"Failed to connect: {reason_code}", file=sys.stderr)
 
 
 def main():
     cfg = load_cfg(CONFIG_FILE)
 
-    # Prepare payloads
-    device_block = {
-        "identifiers": DEVICE_IDENTIFIERS,
-        "name": NODE_NAME,
-        "manufacturer": MANUFACTURER,
-        "model": MODEL,
-    }
-
-    switch_payload = {
-        "name": "Dashboard Display",
-        "unique_id": UNIQUE_SWITCH,
-        "command_topic": TOPIC_COMMAND,
-        "state_topic": TOPIC_STATUS,
-        "availability_topic": TOPIC_AVAIL,
-        "payload_on": "on",
-        "payload_off": "off",
-        "state_on": "on",
-        "state_off": "off",
-        # Map 'unknown' -> unknown so HA shows it correctly
-        "value_template": "{% if value == 'on' %}on{% elif value == 'off' %}off{% else %}unknown{% endif %}",
-        "device": device_block,
-    }
-
-    button_payload = {
-        "name": "Dashboard Display: Refresh Status",
-        "unique_id": UNIQUE_BUTTON,
-        "command_topic": TOPIC_COMMAND,
-        "payload_press": "status",
-        "availability_topic": TOPIC_AVAIL,
-        "device": device_block,
-    }
-
-    # Discovery topics (retain=True so HA picks them up anytime)
-    topic_switch_cfg = f"{DISCOVERY_PREFIX}/switch/dashboard_display/config"
-    topic_button_cfg = f"{DISCOVERY_PREFIX}/button/dashboard_display_status/config"
-
     # Connect
-    client = mqtt.Client(client_id="dashboard-display-discovery-pub", clean_session=True)
+    client = mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2,
+        client_id="dashboard-display-discovery-pub",
+        protocol=mqtt.MQTTv5,
+    )
     client.on_connect = on_connect
 
     # Auth
@@ -108,35 +122,26 @@ def main():
 
     # TLS (optional)
     if cfg.get("tls"):
-        import ssl
-        cafile = cfg.get("cafile")  # optional; if your broker uses public CA, you may omit
-        if cafile:
-            client.tls_set(ca_certs=cafile, certfile=cfg.get("certfile"), keyfile=cfg.get("keyfile"),
-                           tls_version=ssl.PROTOCOL_TLS_CLIENT)
-        else:
-            client.tls_set(tls_version=ssl.PROTOCOL_TLS_CLIENT)
+        client.tls_set_context(mqtt_common.build_ssl_context(cfg))
 
     client.connect(cfg["broker"], int(cfg["port"]), keepalive=30)
 
     client.loop_start()
 
     # Publish retained configs
-    # Note: we publish JSON strings; HA will retain and create entities
-    res1 = client.publish(topic_switch_cfg, json.dumps(switch_payload), qos=1, retain=True)
+    # Note: we publish pre-serialized JSON bytes; HA will retain and create entities
+    # Queue both messages first, then wait for their PUBACKs together
+    res1 = client.publish(TOPIC_SWITCH_CFG, SWITCH_PAYLOAD_JSON, qos=1, retain=True)
+    res2 = client.publish(TOPIC_BUTTON_CFG, BUTTON_PAYLOAD_JSON, qos=1, retain=True)
     res1.wait_for_publish()
-
-    res2 = client.publish(topic_button_cfg, json.dumps(button_payload), qos=1, retain=True)
     res2.wait_for_publish()
 
-    # Give the network loop a moment to flush
-    time.sleep(0.5)
-
     client.loop_stop()
     client.disconnect()
 
     print("Published HA discovery for switch + button (retained).")
-    print(f"- {topic_switch_cfg}")
-    print(f"- {topic_button_cfg}")
+    print(f"- {TOPIC_SWITCH_CFG}")
+    print(f"- {TOPIC_BUTTON_CFG}")
     print("If entities don’t appear, verify the MQTT integration discovery prefix and restart Home Assistant.")
 
 
@@ -2,23 +2,57 @@
 """Minimal HDMI display power control using wlopm."""
 
 import os
+import re
+import shutil
 import subprocess
 import sys
+from typing import Optional
 
 WAYLAND_DISPLAY = "wayland-0"
 XDG_RUNTIME_DIR = f"/run/user/{os.getuid()}"
+# Matches the power mode at the end of each "<output> <mode>" line of wlopm
+WLOPM_MODE_RE = re.compile(rb"\s(on|off)$", re.MULTILINE)
+
+# Set the Wayland session variables once so wlopm inherits them; passing
+# env= on every call would rebuild the child environment each time
+os.environ.setdefault("WAYLAND_DISPLAY", WAYLAND_DISPLAY)
+os.environ.setdefault("XDG_RUNTIME_DIR", XDG_RUNTIME_DIR)
+
+# An absolute executable path plus close_fds=False lets subprocess use
+# posix_spawn instead of fork+exec (Python's own fds are non-inheritable)
+WLOPM = shutil.which("wlopm") or "wlopm"
+
+# Upper bound for a single wlopm call, e.g. if the compositor is frozen
+WLOPM_TIMEOUT_SECONDS = 10
 
 
 def run_wlopm(state: str) -> None:
     """Run wlopm command to control display power."""
     subprocess.run(
-        ["wlopm", f"--{state}", "*"],
-        env={
-            "WAYLAND_DISPLAY": WAYLAND_DISPLAY,
-            "XDG_RUNTIME_DIR": XDG_RUNTIME_DIR,
-        },
+        [WLOPM, f"--{state}", "*"],
+        close_fds=False,
+        check=True,
+        timeout=WLOPM_TIMEOUT_SECONDS,
+    )
+
+
+def read_power() -> Optional[bool]:
+    """Return True if any output is powered on, False if all are off, None if unknown.
+
+    A single wlopm call with no operation lists the power mode of every
+    output, so all displays are probed with one process spawn.
+    """
+    result = subprocess.run(
+        [WLOPM],
+        close_fds=False,
+        capture_output=True,
         check=True,
+        timeout=WLOPM_TIMEOUT_SECONDS,
     )
+    modes = WLOPM_MODE_RE.findall(result.stdout)
+    if not modes:
+        return None
+    return b"on" in modes
 
 
 def main() -> None:
@@ -29,7 +63,17 @@ def main() -> None:
     command = sys.argv[1]
 
     if command == "status":
-        print("Status check not implemented yet")
+        try:
+            state = read_power()
+        except (subprocess.SubprocessError, OSError) as e:
+            # CalledProcessError/TimeoutExpired from wlopm, or wlopm not installed
+            print(f"wlopm failed: {e}", file=sys.stderr)
+            print("Display status unknown")
+            sys.exit(1)
+        if state is None:
+            print("Display status unknown")
+        else:
+            print(f"Display is {'on' if state else 'off'}")
         sys.exit(0)
 
     run_wlopm(command)
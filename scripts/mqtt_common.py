@@ -0,0 +1,53 @@
+"""Helpers shared by the MQTT listener and the HA discovery publisher."""
+
+import json
+import ssl
+import sys
+
+try:
+    import orjson  # optional; faster than the json module
+except ImportError:
+    orjson = None
+
+
+def require_paho_v2() -> None:
+    """Exit with a clear message unless paho-mqtt 2.x is importable"""
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        print("Error: paho-mqtt not installed. Run: pip3 install paho-mqtt", file=sys.stderr)
+        sys.exit(1)
+
+    # The VERSION2 callback API both scripts use only exists in paho-mqtt 2.x
+    if not hasattr(mqtt, "CallbackAPIVersion"):
+        print("Error: paho-mqtt>=2.0 required. Run: pip3 install --upgrade 'paho-mqtt>=2.0'", file=sys.stderr)
+        sys.exit(1)
+
+
+def loads(data: bytes):
+    """Parse JSON with orjson when installed, else the json module"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def dumps(obj, default=None) -> bytes:
+    """Serialize to JSON bytes with orjson when installed, else the json module"""
+    if orjson:
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, default=default).encode()
+
+
+def build_ssl_context(cfg: dict) -> ssl.SSLContext:
+    """Build a client TLS context from the mqtt.json tls/cafile/certfile/keyfile keys.
+
+    Build it once and hand it to paho via tls_set_context(); paho reuses it
+    for every reconnect, so the CA bundle is only parsed once.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    cafile = cfg.get("cafile")  # optional; if your broker uses public CA, you may omit
+    if cafile:
+        context.load_verify_locations(cafile=cafile)
+    else:
+        context.load_default_certs()
+    if cfg.get("certfile"):
+        context.load_cert_chain(cfg["certfile"], cfg.get("keyfile"))
+    return context
@@ -9,72 +9,121 @@ Topics:
   - dashboard/display/command (subscribe): Receives "on", "off", "status" commands
   - dashboard/display/status (publish): Current state "on", "off", "unknown"
   - dashboard/display/availability (publish): "online" or "offline"
+
+TLS is optional: set "tls": true in mqtt.json, plus "cafile" (and
+"certfile"/"keyfile" for client certificates) if the broker needs them.
 """
 
+import functools
 import json
 import logging
+import logging.handlers
+import queue
 import signal
+import ssl
 import subprocess
 import sys
+import threading
 import time
 from pathlib import Path
 from typing import Optional
 
-try:
-    import paho.mqtt.client as mqtt
-except ImportError:
-    print("Error: paho-mqtt not installed. Run: pip3 install paho-mqtt", file=sys.stderr)
-    sys.exit(1)
-
 
 # Configuration
 CONFIG_FILE = Path.home() / "dashboard-project" / "config" / "mqtt.json"
 DISPLAY_CONTROL_SCRIPT = Path.home() / "dashboard-project" / "scripts" / "display_control.py"
 
+# display_control.py is imported in-process rather than spawned per command
+sys.path.insert(0, str(DISPLAY_CONTROL_SCRIPT.parent))
+try:
+    import display_control
+    import mqtt_common
+except ImportError as e:
+    print(f"Error: cannot import helper from {DISPLAY_CONTROL_SCRIPT.parent}: {e}", file=sys.stderr)
+    sys.exit(1)
+
+mqtt_common.require_paho_v2()
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
 # MQTT Topics
 TOPIC_COMMAND = "dashboard/display/command"
 TOPIC_STATUS = "dashboard/display/status"
 TOPIC_AVAILABILITY = "dashboard/display/availability"
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
+# Accepted command payloads (after strip/lower), mapped to command names
+COMMAND_PAYLOADS = {b'on': 'on', b'off': 'off', b'status': 'status'}
+
+# MQTT v5 session expiry, so the broker keeps the subscription across a listener
+# restart or short network outage. Commands are subscribed at QoS 0, so none are
+# queued while offline and a stale on/off can't replay on reconnect
+SESSION_EXPIRY_SECONDS = 24 * 60 * 60
+
+# Commands arriving within this window are coalesced: only the latest on/off
+# runs, and a status request is dropped if that power command published status
+COMMAND_DEBOUNCE_SECONDS = 0.1
+
+# Logging setup: QueueHandler.prepare() still merges the message args (and any
+# exception text) on the calling thread; the timestamped line formatting and
+# the stdout write happen on the QueueListener thread started in main()
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 )
+log_listener = logging.handlers.QueueListener(log_queue, stdout_handler)
+logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+logging.getLogger().setLevel(logging.INFO)
 logger = logging.getLogger("mqtt_listener")
 
 
+@functools.lru_cache(maxsize=4)
+def _parse_config(path: str, mtime_ns: int) -> dict:
+    """Parse a config file; cached per modification time so unchanged files aren't re-read"""
+    return mqtt_common.loads(Path(path).read_bytes())
+
+
 class DisplayMQTTClient:
     """Manages MQTT connection and display control"""
 
     def __init__(self, config_path: Path):
         self.config = self._load_config(config_path)
         self.client: Optional[mqtt.Client] = None
-        self.should_run = True
+        self._commands = {
+            'on': lambda: self._set_power('on'),
+            'off': lambda: self._set_power('off'),
+            'status': self._publish_current_status,
+        }
+        self._pending_power: Optional[str] = None
+        self._status_requested = False
+        self._pending_lock = threading.Lock()
+        self._command_event = threading.Event()
+        self._shutdown = threading.Event()
         self._setup_signal_handlers()
 
     def _load_config(self, config_path: Path) -> dict:
         """Load MQTT configuration from JSON file"""
-        if not config_path.exists():
-            logger.error(f"Config file not found: {config_path}")
+        try:
+            mtime_ns = config_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            logger.error("Config file not found: %s", config_path)
             logger.error("Create config file with: broker, port, username, password")
             sys.exit(1)
 
         try:
-            with open(config_path, 'r') as f:
-                config = json.load(f)
+            config = _parse_config(str(config_path), mtime_ns)
 
             # Validate required fields
             required = ['broker', 'port']
-            if not all(k in config for k in required):
+            if not isinstance(config, dict) or not all(k in config for k in required):
                 raise ValueError(f"Config must contain: {required}")
 
-            return config
+            # Copy so callers can't modify the cached parse result
+            return dict(config)
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
         except (json.JSONDecodeError, ValueError) as e:
-            logger.error(f"Invalid config file: {e}")
+            logger.error("Invalid config file: %s", e)
             sys.exit(1)
 
     def _setup_signal_handlers(self):
@@ -84,118 +133,124 @@ class DisplayMQTTClient:
 
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals"""
-        logger.info(f"Received signal {signum}, shutting down gracefully...")
-        self.should_run = False
-        if self.client:
-            self.client.loop_stop()
-            self.client.disconnect()
+        logger.info("Received signal %s, shutting down gracefully...", signum)
+        # Only wake run(); the MQTT socket is left to paho's network thread
+        self._shutdown.set()
 
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback when connected to MQTT broker"""
-        if rc == 0:
+        if not reason_code.is_failure:
             logger.info("Connected to MQTT broker")
-            # Subscribe to command topic
-            client.subscribe(TOPIC_COMMAND)
-            logger.info(f"Subscribed to {TOPIC_COMMAND}")
+            # Subscribe to command topic (QoS 0: missed commands are not replayed)
+            client.subscribe(TOPIC_COMMAND, qos=0)
+            logger.info("Subscribed to %s", TOPIC_COMMAND)
 
             # Publish availability
             client.publish(TOPIC_AVAILABILITY, "online", qos=1, retain=True)
 
-            # Publish initial status
-            self._publish_current_status()
+            # Publish initial status (queried on the command worker, not this thread)
+            self._handle_command('status')
         else:
-            logger.error(f"Failed to connect, return code {rc}")
+            logger.error("Failed to connect: %s", reason_code)
 
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
         """Callback when disconnected from broker"""
-        if rc != 0:
-            logger.warning(f"Unexpected disconnect (code {rc}), will attempt reconnect")
+        if reason_code != 0:
+            logger.warning("Unexpected disconnect (%s), will attempt reconnect", reason_code)
         else:
             logger.info("Disconnected from MQTT broker")
 
     def _on_message(self, client, userdata, msg):
         """Callback when message received on subscribed topic"""
         try:
-            command = msg.payload.decode('utf-8').strip().lower()
-            logger.info(f"Received command: {command}")
+            # Match on the raw bytes; only unknown payloads are decoded for logging
+            payload = msg.payload.strip().lower()
+            command = COMMAND_PAYLOADS.get(payload)
 
-            if command in ['on', 'off', 'status']:
+            if command:
+                logger.info("Received command: %s", command)
                 self._handle_command(command)
             else:
-                logger.warning(f"Unknown command: {command}")
+                logger.warning("Unknown command: %s", payload.decode('utf-8', 'replace'))
 
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
 
     def _handle_command(self, command: str):
-        """Execute display control command and publish status"""
-        try:
-            # Run display_control.py with the command
-            result = subprocess.run(
-                ['python3', str(DISPLAY_CONTROL_SCRIPT), command],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-
-            if result.returncode == 0:
-                logger.info(f"Command '{command}' executed successfully")
-
-                # For 'on' and 'off', publish the new status immediately
-                if command in ['on', 'off']:
-                    self._publish_status(command)
-                # For 'status', query and publish actual status
-                elif command == 'status':
-                    self._publish_current_status()
+        """Queue a command for the worker thread, replacing any on/off not yet run"""
+        with self._pending_lock:
+            if command == 'status':
+                self._status_requested = True
             else:
-                logger.error(f"Command failed: {result.stderr}")
-
+                self._pending_power = command
+            self._command_event.set()
+
+    def _command_worker(self):
+        """Run the queued commands once the debounce window has passed"""
+        while True:
+            self._command_event.wait()
+            time.sleep(COMMAND_DEBOUNCE_SECONDS)
+            with self._pending_lock:
+                power = self._pending_power
+                status_requested = self._status_requested
+                self._pending_power = None
+                self._status_requested = False
+                self._command_event.clear()
+            # A successful on/off already publishes the new status
+            if power and self._run_command(power):
+                continue
+            if status_requested:
+                self._run_command('status')
+
+    def _run_command(self, command: str) -> bool:
+        """Execute display control command and publish status; True on success"""
+        try:
+            self._commands[command]()
+            return True
         except subprocess.TimeoutExpired:
-            logger.error(f"Command '{command}' timed out")
-        except FileNotFoundError:
-            logger.error(f"Display control script not found: {DISPLAY_CONTROL_SCRIPT}")
+            logger.error("Command '%s' timed out", command)
+        except subprocess.CalledProcessError as e:
+            logger.error("Command '%s' failed: %s", command, e)
         except Exception as e:
-            logger.error(f"Error executing command: {e}")
+            logger.error("Error executing command: %s", e)
+        return False
+
+    def _set_power(self, state: str):
+        """Switch the display on/off and publish the new status"""
+        display_control.run_wlopm(state)
+        logger.info("Command '%s' executed successfully", state)
+        self._publish_status(state)
 
     def _publish_status(self, status: str):
         """Publish display status to MQTT"""
         if self.client and self.client.is_connected():
             self.client.publish(TOPIC_STATUS, status, qos=1, retain=True)
-            logger.info(f"Published status: {status}")
+            logger.info("Published status: %s", status)
 
     def _publish_current_status(self):
         """Query current display status and publish it"""
         try:
-            result = subprocess.run(
-                ['python3', str(DISPLAY_CONTROL_SCRIPT), 'status'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-
-            if result.returncode == 0:
-                # Parse output for status (display_control.py outputs "Display is on/off")
-                output = result.stdout.strip().lower()
-                if 'is on' in output:
-                    status = 'on'
-                elif 'is off' in output:
-                    status = 'off'
-                else:
-                    status = 'unknown'
-
-                self._publish_status(status)
-            else:
-                logger.error(f"Failed to get status: {result.stderr}")
-                self._publish_status('unknown')
-
+            state = display_control.read_power()
+        except subprocess.TimeoutExpired:
+            logger.error("Status query timed out")
+            state = None
         except Exception as e:
-            logger.error(f"Error getting status: {e}")
+            logger.error("Error getting status: %s", e)
+            state = None
+
+        if state is None:
             self._publish_status('unknown')
+        else:
+            self._publish_status('on' if state else 'off')
 
     def run(self):
         """Main loop - connect to broker and start listening"""
         # Initialize MQTT client
-        self.client = mqtt.Client(client_id="dashboard-display-pi", clean_session=False)
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id="dashboard-display-pi",
+            protocol=mqtt.MQTTv5
+        )
 
         # Set up callbacks
         self.client.on_connect = self._on_connect
@@ -212,49 +267,69 @@ class DisplayMQTTClient:
                 self.config.get('password', '')
             )
 
+        # TLS (optional)
+        if self.config.get('tls'):
+            try:
+                self.client.tls_set_context(mqtt_common.build_ssl_context(self.config))
+            except (OSError, ssl.SSLError) as e:
+                logger.error("Failed to load TLS certificates: %s", e)
+                sys.exit(1)
+
+        # A shutdown signal may arrive before the client exists; don't connect then
+        if self._shutdown.is_set():
+            logger.info("Shutdown requested before connecting")
+            return
+
         # Connect to broker
-        logger.info(f"Connecting to MQTT broker at {self.config['broker']}:{self.config['port']}")
+        logger.info("Connecting to MQTT broker at %s:%s", self.config['broker'], self.config['port'])
+
+        # Persistent session (MQTT v5 replacement for clean_session=False)
+        connect_properties = Properties(PacketTypes.CONNECT)
+        connect_properties.SessionExpiryInterval = SESSION_EXPIRY_SECONDS
 
         try:
             self.client.connect(
                 self.config['broker'],
                 self.config['port'],
-                keepalive=60
+                keepalive=60,
+                clean_start=False,
+                properties=connect_properties
             )
         except Exception as e:
-            logger.error(f"Failed to connect to broker: {e}")
+            logger.error("Failed to connect to broker: %s", e)
             sys.exit(1)
 
-        # Start the network loop
+        # Display commands run off the network thread so they can be debounced
+        threading.Thread(target=self._command_worker, name="display-commands", daemon=True).start()
+
+        # paho's network thread owns the socket; publishes from other threads are
+        # only queued for it. It also reconnects after unexpected disconnects
         self.client.loop_start()
 
-        # Keep running until shutdown signal
-        try:
-            while self.should_run:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Keyboard interrupt received")
-        finally:
-            # Clean shutdown
-            if self.client:
-                self.client.publish(TOPIC_AVAILABILITY, "offline", qos=1, retain=True)
-                self.client.loop_stop()
-                self.client.disconnect()
-            logger.info("Shutdown complete")
+        # Block until a shutdown signal arrives
+        self._shutdown.wait()
+
+        # A clean disconnect doesn't trigger the LWT, so publish offline first
+        if self.client.is_connected():
+            offline = self.client.publish(TOPIC_AVAILABILITY, "offline", qos=1, retain=True)
+            offline.wait_for_publish(timeout=5)
+        self.client.disconnect()
+        self.client.loop_stop()
+        logger.info("Shutdown complete")
 
 
 def main():
     """Entry point"""
-    logger.info("Starting MQTT Display Control Listener")
-
-    # Verify display control script exists
-    if not DISPLAY_CONTROL_SCRIPT.exists():
-        logger.error(f"Display control script not found: {DISPLAY_CONTROL_SCRIPT}")
-        sys.exit(1)
-
-    # Create and run client
-    client = DisplayMQTTClient(CONFIG_FILE)
-    client.run()
+    log_listener.start()
+    try:
+        logger.info("Starting MQTT Display Control Listener")
+
+        # Create and run client
+        client = DisplayMQTTClient(CONFIG_FILE)
+        client.run()
+    finally:
+        # Flush queued log records, including on sys.exit()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
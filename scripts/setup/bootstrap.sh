@@ -114,7 +114,7 @@ install_touchscreen_service() {
 
 install_mqtt_dependencies() {
   log "Installing MQTT client library (paho-mqtt)..."
- # pip3 install --user paho-mqtt
+ # pip3 install --user 'paho-mqtt>=2.0'
 }
 
 configure_mqtt() {
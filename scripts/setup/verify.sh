@@ -32,6 +32,19 @@ require_python_module() {
   fi
 }
 
+check_paho_version() {
+  # Missing module is already reported by require_python_module
+  if ! python3 -c "import paho.mqtt.client" >/dev/null 2>&1; then
+    return
+  fi
+
+  if python3 -c "import paho.mqtt.client as mqtt; mqtt.CallbackAPIVersion" >/dev/null 2>&1; then
+    log "paho-mqtt is 2.0 or newer."
+  else
+    issues+=("paho-mqtt 2.0+ required; run: pip3 install --upgrade 'paho-mqtt>=2.0'")
+  fi
+}
+
 check_docker() {
   local install_docker_flag
   install_docker_flag=${INSTALL_DOCKER:-0}
@@ -121,6 +134,7 @@ main() {
   require_python_module gpiozero
   require_python_module RPi.GPIO
   require_python_module paho.mqtt.client
+  check_paho_version
   check_autostart
   check_kiosk_script
   check_touchscreen_service